@@ -1,23 +1,79 @@
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import argparse
-import glob
 from datetime import datetime
-import re
 from tabulate import tabulate
 import sys
-
-def extract_datetime_from_path(file_path):
-    """Extract year, month, day, hour from file path based on the structure."""
-    # Extract components from directory structure
-    pattern = r'year=(\d{4})/month=(\d{2})/day=(\d{2})/hour=(\d{2})/'
-    match = re.search(pattern, file_path)
-
-    if match:
-        year, month, day, hour = match.groups()
-        return f"{year}-{month}-{day}-{hour}"
-
-    return None
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+# Number of parallel threads for reading parquet footers
+MAX_WORKERS = 32
+
+# Hive partition directories to descend into when scanning for files
+PARTITION_PREFIXES = ('year=', 'month=', 'day=', 'hour=')
+
+# Sidecar file in each compared directory caching the row count of every file
+CACHE_FILE = '.rowcounts.parquet'
+CACHE_SCHEMA = pa.schema([
+    ('path', pa.string()),
+    ('datetime', pa.string()),
+    ('row_count', pa.int64()),
+    ('mtime', pa.int64())
+])
+
+def walk_parquet_files(root, partitions=()):
+    """
+    Yield (path, datetime, mtime) for parquet files below root, descending only
+    into year=/month=/day=/hour= partitions. The partition values are collected
+    on the way down, so datetime is "YYYY-MM-DD-HH" or None outside a full path.
+    """
+    for entry in os.scandir(root):
+        if entry.is_dir():
+            if entry.name.startswith(PARTITION_PREFIXES):
+                value = entry.name.split('=', 1)[1]
+                yield from walk_parquet_files(entry.path, partitions + (value,))
+        elif entry.is_file() and entry.name.endswith('.parquet'):
+            datetime_str = '-'.join(partitions) if len(partitions) == 4 else None
+            yield entry.path, datetime_str, entry.stat().st_mtime_ns
+
+def get_file_info(file_path, datetime_str, mtime):
+    """Get the date and row count for a single parquet file."""
+    try:
+        # Only the footer is needed for the row count
+        row_count = pq.read_metadata(file_path).num_rows
+    except Exception as e:
+        print(f"Error reading {file_path}: {str(e)}", file=sys.stderr)
+        return None
+
+    return {
+        'path': file_path,
+        'datetime': datetime_str,
+        'row_count': row_count,
+        'mtime': mtime
+    }
+
+def load_cache(directory):
+    """Load the cached file info of a directory, keyed by path."""
+    cache_path = os.path.join(directory, CACHE_FILE)
+    if not os.path.exists(cache_path):
+        return {}
+
+    try:
+        return {info['path']: info for info in pq.read_table(cache_path).to_pylist()}
+    except Exception as e:
+        print(f"Error reading cache {cache_path}, ignoring it: {str(e)}", file=sys.stderr)
+        return {}
+
+def save_cache(directory, file_info):
+    """Save the file info of a directory so unchanged files are not re-read next time."""
+    cache_path = os.path.join(directory, CACHE_FILE)
+    try:
+        pq.write_table(pa.Table.from_pylist(file_info, schema=CACHE_SCHEMA), cache_path)
+    except Exception as e:
+        print(f"Error writing cache {cache_path}: {str(e)}", file=sys.stderr)
 
 def get_all_parquet_files(directory):
     """Get all parquet files in the directory with their date and row count."""
@@ -26,39 +82,44 @@ def get_all_parquet_files(directory):
         print(f"Warning: Could not find 'year=2024' in {directory}", file=sys.stderr)
         print(f"Contents of {directory}: {os.listdir(directory)}", file=sys.stderr)
 
-    # Try multiple possible patterns to locate the files
-    patterns = [
-        os.path.join(directory, "year=*/month=*/day=*/hour=*/*.parquet"),
-        os.path.join(directory, "*/year=*/month=*/day=*/hour=*/*.parquet"),
-        os.path.join(directory, "*/*/*/*.parquet")  # Last resort - any deeply nested parquet file
-    ]
-
-    files = []
-    for pattern in patterns:
-        files = glob.glob(pattern)
-        if files:
-            print(f"Found files using pattern: {pattern}")
-            break
+    files = [f for f in walk_parquet_files(directory) if f[1]]
+    if not files:
+        # The partitions may be nested one level down, e.g. <dir>/<bucket>/year=*/...
+        for entry in os.scandir(directory):
+            if entry.is_dir():
+                files.extend(f for f in walk_parquet_files(entry.path) if f[1])
 
+    # Reuse cached row counts for files that have not been modified since the last run
+    cache = load_cache(directory)
     file_info = []
-    for file_path in files:
-        datetime_str = extract_datetime_from_path(file_path)
-        if datetime_str:
-            try:
-                df = pd.read_parquet(file_path)
-                row_count = len(df)
-                file_info.append({
-                    'path': file_path,
-                    'datetime': datetime_str,
-                    'row_count': row_count
-                })
-            except Exception as e:
-                print(f"Error reading {file_path}: {str(e)}", file=sys.stderr)
+    to_read = []
+    for file_path, datetime_str, mtime in files:
+        cached = cache.get(file_path)
+        if cached and cached['mtime'] == mtime:
+            file_info.append(cached)
+        else:
+            to_read.append((file_path, datetime_str, mtime))
+
+    if cache:
+        print(f"Using cached row counts for {len(file_info)} files, reading {len(to_read)}")
+
+    # Footer reads are I/O bound, so overlap them across files
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        results = list(tqdm(pool.map(lambda f: get_file_info(*f), to_read), total=len(to_read), desc=os.path.basename(directory)))
+
+    file_info.extend(info for info in results if info)
+
+    if to_read or len(file_info) != len(cache):
+        save_cache(directory, file_info)
 
     return file_info
 
 def compare_directories(dir1, dir2):
     """Compare row counts of parquet files in two directories."""
+    name1 = os.path.basename(dir1)
+    name2 = os.path.basename(dir2)
+    in_col1, in_col2 = f'in_{name1}', f'in_{name2}'
+
     print(f"Processing files in {dir1}...")
     files1 = get_all_parquet_files(dir1)
     print(f"Found {len(files1)} parquet files in {dir1}")
@@ -67,77 +128,64 @@ def compare_directories(dir1, dir2):
     files2 = get_all_parquet_files(dir2)
     print(f"Found {len(files2)} parquet files in {dir2}")
 
-    # Create dictionaries for quick lookup by datetime
-    files1_dict = {f['datetime']: f for f in files1}
-    files2_dict = {f['datetime']: f for f in files2}
+    # Row counts per datetime, joined so hours missing from either side are kept
+    columns = ['path', 'datetime', 'row_count']
+    counts1 = pd.DataFrame(files1, columns=columns).groupby('datetime')['row_count'].sum()
+    counts2 = pd.DataFrame(files2, columns=columns).groupby('datetime')['row_count'].sum()
+    merged = pd.concat([counts1.rename('rows1'), counts2.rename('rows2')], axis=1).sort_index()
 
-    # Get all unique datetimes
-    all_datetimes = sorted(set(list(files1_dict.keys()) + list(files2_dict.keys())))
+    rows1 = merged['rows1'].fillna(0).astype(int)
+    rows2 = merged['rows2'].fillna(0).astype(int)
+    diff = rows1 - rows2
+    pct_diff = (diff / rows2.where(rows2 > 0) * 100).fillna(0).round(2)
 
     # Prepare comparison results
-    comparison_results = []
-
-    for dt in all_datetimes:
-        in_dir1 = dt in files1_dict
-        in_dir2 = dt in files2_dict
-
-        row_count1 = files1_dict[dt]['row_count'] if in_dir1 else 0
-        row_count2 = files2_dict[dt]['row_count'] if in_dir2 else 0
-
-        diff = row_count1 - row_count2
-        pct_diff = 0
-        if row_count2 > 0:
-            pct_diff = (diff / row_count2) * 100
-
-        comparison_results.append({
-            'datetime': dt,
-            'in_' + os.path.basename(dir1): in_dir1,
-            'in_' + os.path.basename(dir2): in_dir2,
-            os.path.basename(dir1) + '_rows': row_count1,
-            os.path.basename(dir2) + '_rows': row_count2,
-            'difference': diff,
-            'pct_difference': round(pct_diff, 2)
-        })
+    comparison_results = pd.DataFrame({
+        'datetime': merged.index,
+        in_col1: merged['rows1'].notna().to_numpy(),
+        in_col2: merged['rows2'].notna().to_numpy(),
+        f'{name1}_rows': rows1.to_numpy(),
+        f'{name2}_rows': rows2.to_numpy(),
+        'difference': diff.to_numpy(),
+        'pct_difference': pct_diff.to_numpy()
+    })
+    in_dir1 = comparison_results[in_col1]
+    in_dir2 = comparison_results[in_col2]
 
     # Print results as a table
     print("\nComparison Results:")
 
     # Calculate totals
-    total_rows1 = sum(f['row_count'] for f in files1)
-    total_rows2 = sum(f['row_count'] for f in files2)
+    total_rows1 = int(counts1.sum())
+    total_rows2 = int(counts2.sum())
     total_diff = total_rows1 - total_rows2
     total_pct_diff = 0
     if total_rows2 > 0:
         total_pct_diff = (total_diff / total_rows2) * 100
 
     print(f"\nTotal row counts:")
-    print(f"{os.path.basename(dir1)}: {total_rows1} rows")
-    print(f"{os.path.basename(dir2)}: {total_rows2} rows")
+    print(f"{name1}: {total_rows1} rows")
+    print(f"{name2}: {total_rows2} rows")
     print(f"Difference: {total_diff} rows ({round(total_pct_diff, 2)}%)")
 
     # Print only files with differences
-    diff_results = [r for r in comparison_results if r['difference'] != 0 or not (r['in_' + os.path.basename(dir1)] and r['in_' + os.path.basename(dir2)])]
+    diff_results = comparison_results[(comparison_results['difference'] != 0) | ~(in_dir1 & in_dir2)]
 
-    if diff_results:
+    if not diff_results.empty:
         print("\nFiles with missing data or row count differences:")
-        headers = diff_results[0].keys()
-        rows = [list(result.values()) for result in diff_results]
-        print(tabulate(rows, headers=headers, tablefmt="grid"))
+        print(tabulate(diff_results, headers="keys", tablefmt="grid", showindex=False))
     else:
         print("\nAll files have identical row counts.")
 
     # Summary statistics
-    missing_in_dir1 = sum(1 for r in comparison_results if not r['in_' + os.path.basename(dir1)])
-    missing_in_dir2 = sum(1 for r in comparison_results if not r['in_' + os.path.basename(dir2)])
-    files_with_less_rows = sum(1 for r in comparison_results
-                             if r['in_' + os.path.basename(dir1)]
-                             and r['in_' + os.path.basename(dir2)]
-                             and r[os.path.basename(dir1) + '_rows'] < r[os.path.basename(dir2) + '_rows'])
+    missing_in_dir1 = int((~in_dir1).sum())
+    missing_in_dir2 = int((~in_dir2).sum())
+    files_with_less_rows = int((in_dir1 & in_dir2 & (diff < 0).to_numpy()).sum())
 
     print(f"\nSummary:")
-    print(f"Files missing in {os.path.basename(dir1)}: {missing_in_dir1}")
-    print(f"Files missing in {os.path.basename(dir2)}: {missing_in_dir2}")
-    print(f"Files in {os.path.basename(dir1)} with fewer rows than {os.path.basename(dir2)}: {files_with_less_rows}")
+    print(f"Files missing in {name1}: {missing_in_dir1}")
+    print(f"Files missing in {name2}: {missing_in_dir2}")
+    print(f"Files in {name1} with fewer rows than {name2}: {files_with_less_rows}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Compare row counts of parquet files in two directories')
@@ -41,7 +41,7 @@ schema = pa.schema([
     ('SOG', pa.float32()),
     ('COG', pa.float32()),
     ('Heading', pa.float32()),
-    ('VesselName', pa.string()),
+    ('VesselName', pa.dictionary(pa.int32(), pa.string())),  # Read dictionary-encoded, see PARQUET_FORMAT
     ('IMO', pa.string()),
     ('CallSign', pa.string()),
     ('VesselType', pa.int32()),
@@ -53,6 +53,19 @@ schema = pa.schema([
     ('TransceiverClass', pa.string())
 ])
 
+# Keep VesselName dictionary-encoded when reading so it is never decoded to strings,
+# and pre-buffer column chunks so nearby S3 range reads are coalesced into fewer requests
+PARQUET_FORMAT = ds.ParquetFileFormat(
+    read_options=ds.ParquetReadOptions(dictionary_columns=['VesselName']),
+    default_fragment_scan_options=ds.ParquetFragmentScanOptions(
+        pre_buffer=True,
+        cache_options=pa.CacheOptions(
+            hole_size_limit=1 << 20,    # Merge reads separated by less than 1 MB
+            range_size_limit=32 << 20   # Cap a merged read at 32 MB
+        )
+    )
+)
+
 def get_unique_vessel_names_month01():
     """
     Get unique vessel names and their record counts from month=01 parquet files
@@ -76,30 +89,45 @@ def get_unique_vessel_names_month01():
     dataset = ds.dataset(
         base_path,
         filesystem=s3,
-        format="parquet",
+        format=PARQUET_FORMAT,
         schema=schema
     )
     
     log_message(f"Dataset created successfully. Scanning for vessel names...")
     
-    # Filter out empty vessel names and extract unique vessel names and their counts
-    log_message("Extracting VesselName column...")
-    table = dataset.to_table(columns=["VesselName"])
-    log_message("Filtering out empty or null vessel names...")
-    
-    # Filter out null values
-    mask = pc.is_valid(table["VesselName"])
-    table = table.filter(mask)
-    
-    # Filter out empty strings
-    mask = pc.not_equal(table["VesselName"], "")
-    table = table.filter(mask)
+    # Filter out null and empty vessel names while scanning, so row groups
+    # without any names are skipped
+    log_message("Counting non-empty VesselName values...")
+    vessel_filter = ds.field("VesselName").is_valid() & (ds.field("VesselName") != "")
+    # Read ahead more files and batches than the defaults to keep S3 requests in flight
+    scanner = ds.Scanner.from_dataset(
+        dataset,
+        columns=["VesselName"],
+        filter=vessel_filter,
+        use_threads=True,
+        fragment_readahead=16,
+        batch_readahead=32
+    )
+
+    # Count each batch as it streams in and keep only the per-batch counts,
+    # so the full column is never held in memory
+    partial_counts = [pa.table({"VesselName": pa.array([], pa.string()), "RecordCount": pa.array([], pa.int64())})]
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        counts = pc.value_counts(batch.column("VesselName"))
+        partial_counts.append(pa.table({
+            "VesselName": counts.field("values").dictionary_decode(),
+            "RecordCount": counts.field("counts")
+        }))
     
-    log_message("Grouping vessel names and counting records...")
-    # Group by vessel name and count occurrences
-    vessel_counts = table.group_by("VesselName").aggregate([("VesselName", "count")]).to_pandas()
-    vessel_counts.columns = ["VesselName", "RecordCount"]
-    vessel_counts = vessel_counts.sort_values("RecordCount", ascending=False)
+    log_message("Combining vessel name counts...")
+    # Sum the per-batch counts and sort in Arrow before converting
+    totals = pa.concat_tables(partial_counts).group_by("VesselName").aggregate([("RecordCount", "sum")])
+    vessel_counts = pa.table({
+        "VesselName": totals["VesselName"],
+        "RecordCount": totals["RecordCount_sum"]
+    }).sort_by([("RecordCount", "descending")]).to_pandas()
     
     elapsed_time = time.time() - start_time
     log_message(f"Processing completed in {elapsed_time:.2f} seconds")
@@ -25,7 +25,7 @@ schema = pa.schema([
     ('SOG', pa.float32()),
     ('COG', pa.float32()),
     ('Heading', pa.float32()),
-    ('VesselName', pa.string()),
+    ('VesselName', pa.dictionary(pa.int32(), pa.string())),  # Read dictionary-encoded, see PARQUET_FORMAT
     ('IMO', pa.string()),
     ('CallSign', pa.string()),
     ('VesselType', pa.int32()),
@@ -37,6 +37,11 @@ schema = pa.schema([
     ('TransceiverClass', pa.string())
 ])
 
+# Keep VesselName dictionary-encoded when reading so it is never decoded to strings
+PARQUET_FORMAT = ds.ParquetFileFormat(
+    read_options=ds.ParquetReadOptions(dictionary_columns=['VesselName'])
+)
+
 def get_unique_vessel_names():
     # Initialize S3 filesystem
     s3 = S3FileSystem(
@@ -51,14 +56,15 @@ def get_unique_vessel_names():
     dataset = ds.dataset(
         S3_BUCKET_NAME,
         filesystem=s3,
-        format="parquet",
+        format=PARQUET_FORMAT,
         schema=schema
     )
 
     # Extract unique vessel names and their counts
     print("Analyzing vessel names...")
     table = dataset.to_table(columns=["VesselName"])
-    vessel_counts = table.group_by("VesselName").aggregate([("VesselName", "count")]).to_pandas()
+    # Each file has its own dictionary, so unify them before grouping
+    vessel_counts = table.unify_dictionaries().group_by("VesselName").aggregate([("VesselName", "count")]).to_pandas()
     vessel_counts.columns = ["VesselName", "RecordCount"]
     vessel_counts = vessel_counts.sort_values("RecordCount", ascending=False)
 
@@ -2,24 +2,33 @@
 """
 Script to download AIS data from NOAA, convert it to parquet files, and optionally upload to S3.
 The parquet files are organized in a hierarchical directory structure:
-year=YYYY/month=MM/day=DD/hour=HH/AIS_YYYY_MM_DD_processed_hourHH.parquet
+year=YYYY/month=MM/day=DD/hour=HH/AIS_YYYY_MM_DD_processed_hourHH_part-<source>.parquet
+where <source> is the name of the CSV the rows came from, so an hour may hold several parts.
 """
 
 import os
 import sys
 import logging
+import hashlib
+import json
 import re
 from datetime import datetime
 from pathlib import Path
 import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import pyarrow.parquet as pq
 from tqdm import tqdm
 import boto3
+from boto3.s3.transfer import S3Transfer, TransferConfig
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -41,6 +50,17 @@ logger = logging.getLogger("zip2parquet")
 BASE_URL = "https://coast.noaa.gov/htdata/CMSP/AISDataHandler/2024"
 TMP_DIR = Path("tmp")
 OUTPUT_DIR = Path(".")
+CSV_BLOCK_SIZE = 64 * 1024 * 1024  # Bytes of CSV to parse at a time
+ROW_GROUP_SIZE = 100_000  # Rows buffered per hour before writing a Parquet row group
+SKIP_PROCESSED = True  # Skip ZIP files that were already processed in an earlier run
+MANIFEST_FILE = OUTPUT_DIR / "processed.jsonl"  # Record of the ZIP files processed so far
+
+# Parallel Processing
+MAX_WORKERS = 4  # Number of parallel threads for writing Parquet row groups and uploading to S3
+DOWNLOAD_AHEAD = 2  # Number of ZIP files downloaded ahead of the one being processed
+DOWNLOAD_PARTS = 8  # Number of parallel range requests per ZIP download
+RANGED_DOWNLOAD_MIN_SIZE = 16 * 1024 * 1024  # Smaller files are downloaded in one request
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024  # Bytes read from the connection at a time
 
 # S3 Configuration
 ENABLE_S3_UPLOAD = False  # Set to True to enable S3 upload
@@ -50,9 +70,60 @@ S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'ACCESS_KEY')
 S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'SECRET_KEY')
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME', 'noaa-ais-data')
 
+# Upload large files in parallel 16 MB parts
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# HTTP session shared by all requests to NOAA, so connections are kept alive
+# between downloads and transient server errors are retried
+http_session = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+)
+http_session.mount('https://', http_adapter)
+http_session.mount('http://', http_adapter)
+
+# Links to ZIP files in the index page, with either quote style
+ZIP_HREF_PATTERN = re.compile(r'href=["\']([^"\']+\.zip)["\']')
+
+# Order of the rows within each row group, so readers can look up a vessel's
+# track from the MMSI statistics instead of scanning every page
+SORT_KEYS = [('MMSI', 'ascending'), ('BaseDateTime', 'ascending')]
+
 # Create required directories
 TMP_DIR.mkdir(exist_ok=True)
 
+# S3 client and transfer manager shared by all uploads, see get_s3_transfer()
+s3_client = None
+s3_transfer = None
+
+# Column types based on the data dictionary
+CSV_COLUMN_TYPES = {
+    'MMSI': pa.string(),               # Text (9)
+    'BaseDateTime': pa.timestamp('ns'),  # DateTime, YYYY-MM-DDTHH:MM:SS
+    'LAT': pa.float64(),               # Double (8)
+    'LON': pa.float64(),               # Double (8)
+    'SOG': pa.float32(),               # Float (4)
+    'COG': pa.float32(),               # Float (4)
+    'Heading': pa.float32(),           # Float (4)
+    'VesselName': pa.string(),         # Text (32)
+    'IMO': pa.string(),                # Text (7)
+    'CallSign': pa.string(),           # Text (8)
+    'VesselType': pa.int16(),          # Integer short
+    'Status': pa.int8(),               # Integer short, navigation status 0-15
+    'Length': pa.float32(),            # Float (4)
+    'Width': pa.float32(),             # Float (4)
+    'Draft': pa.float32(),             # Float (4)
+    'Cargo': pa.dictionary(pa.int32(), pa.string()),             # Text (4), few distinct codes
+    'TransceiverClass': pa.dictionary(pa.int32(), pa.string())   # Text (2), 'A' or 'B'
+}
+
 def get_zip_urls():
     """
     Extract all ZIP file URLs from the NOAA AIS data handler index page
@@ -61,14 +132,13 @@ def get_zip_urls():
         List of URLs to ZIP files
     """
     logger.info(f"Fetching ZIP URLs from {BASE_URL}")
-    response = requests.get(BASE_URL)
+    response = http_session.get(BASE_URL)
     response.raise_for_status()
 
-    soup = BeautifulSoup(response.text, 'html.parser')
     urls = []
 
-    for link in soup.find_all('a', href=re.compile(r'\.zip$')):
-        href = link.get('href')
+    # The index is a plain listing, so scanning for the hrefs is enough
+    for href in ZIP_HREF_PATTERN.findall(response.text):
         # Handle relative URLs properly
         if href.startswith('http'):
             url = href  # It's already an absolute URL
@@ -85,10 +155,43 @@ def get_zip_urls():
     logger.info(f"Found {len(urls)} ZIP files")
     return urls
 
+def download_range(url, dest_path, start, end, progress_bar):
+    """
+    Download one byte range of a URL into the same offset of an existing file
+
+    Args:
+        url: URL to download
+        dest_path: Path to the pre-allocated file to write into
+        start: First byte of the range
+        end: Last byte of the range (inclusive)
+        progress_bar: tqdm progress bar shared by all ranges of the download
+
+    Returns:
+        Number of bytes written
+    """
+    response = http_session.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True)
+    response.raise_for_status()
+
+    if response.status_code != 206:
+        raise ValueError(f"Server ignored range request for {url}")
+
+    written = 0
+    with open(dest_path, 'r+b') as f:
+        f.seek(start)
+        for data in response.iter_content(DOWNLOAD_BLOCK_SIZE):
+            progress_bar.update(len(data))
+            f.write(data)
+            written += len(data)
+
+    return written
+
 def download_file(url, dest_path):
     """
     Download a file from a URL with progress reporting
 
+    Large files are fetched as DOWNLOAD_PARTS parallel range requests when the
+    server supports them, since a single connection rarely uses the full bandwidth.
+
     Args:
         url: URL to download
         dest_path: Path to save the file to
@@ -101,247 +204,466 @@ def download_file(url, dest_path):
     # Create parent directory if it doesn't exist
     dest_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # Stream download with progress reporting
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
+    head = http_session.head(url, allow_redirects=True)
+    total_size = int(head.headers.get('content-length', 0))
+    use_ranges = (head.ok and head.headers.get('accept-ranges') == 'bytes'
+                  and total_size >= RANGED_DOWNLOAD_MIN_SIZE)
 
-    total_size = int(response.headers.get('content-length', 0))
-    block_size = 1024  # 1 KB
     progress_bar = tqdm(total=total_size, unit='iB', unit_scale=True, desc=dest_path.name)
 
-    with open(dest_path, 'wb') as f:
-        for data in response.iter_content(block_size):
-            progress_bar.update(len(data))
-            f.write(data)
+    # Count the bytes separately, the progress bar is only for display and is
+    # updated from several threads without a lock
+    downloaded = 0
+
+    try:
+        if use_ranges:
+            # Pre-allocate the file so every range can be written at its own offset
+            with open(dest_path, 'wb') as f:
+                f.truncate(total_size)
+
+            part_size = -(-total_size // DOWNLOAD_PARTS)  # Round up
+            ranges = [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_PARTS) as pool:
+                futures = [pool.submit(download_range, url, dest_path, start, end, progress_bar) for start, end in ranges]
+                downloaded = sum(future.result() for future in futures)
+
+            # The parts arrive out of order, so hash the file once it is complete
+            sha256 = hashlib.sha256()
+            with open(dest_path, 'rb') as f:
+                for data in iter(lambda: f.read(DOWNLOAD_BLOCK_SIZE), b''):
+                    sha256.update(data)
+        else:
+            # Stream download with progress reporting
+            response = http_session.get(url, stream=True)
+            response.raise_for_status()
 
-    progress_bar.close()
+            total_size = int(response.headers.get('content-length', 0))
+            progress_bar.total = total_size
 
-    if total_size != 0 and progress_bar.n != total_size:
-        logger.warning(f"Download incomplete for {url}. Expected {total_size} bytes, got {progress_bar.n} bytes.")
+            # Hash the data as it is written so the file doesn't need a second pass
+            sha256 = hashlib.sha256()
+
+            with open(dest_path, 'wb') as f:
+                for data in response.iter_content(DOWNLOAD_BLOCK_SIZE):
+                    progress_bar.update(len(data))
+                    sha256.update(data)
+                    f.write(data)
+                    downloaded += len(data)
+    finally:
+        progress_bar.close()
+
+    if total_size != 0 and downloaded != total_size:
+        logger.warning(f"Download incomplete for {url}. Expected {total_size} bytes, got {downloaded} bytes.")
+
+    logger.info(f"SHA-256 of {dest_path.name}: {sha256.hexdigest()}")
 
     return dest_path
 
-def extract_zip(zip_path):
+def process_zip(zip_path):
     """
-    Extract a ZIP file
+    Process the CSV inside a ZIP file without extracting it to disk
 
     Args:
         zip_path: Path to the ZIP file
+    """
+    logger.info(f"Reading {zip_path}")
+
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        csv_name = next((file for file in zip_ref.namelist() if file.endswith('.csv')), None)
+        if not csv_name:
+            raise ValueError(f"No CSV file found in {zip_path}")
+
+        # Decompress straight into the CSV reader
+        with zip_ref.open(csv_name) as csv_file:
+            process_csv(csv_file, csv_name)
+
+def open_hour_writer(year, month, day, hour, source, schema):
+    """
+    Open a Parquet writer for one source's part of an hour of data
+
+    Every source CSV writes its own part file, so rows a CSV has for an hour that
+    another CSV already wrote (e.g. around midnight) are added rather than
+    replacing that file. Only a part from the same source is replaced.
+
+    Args:
+        year, month, day, hour: Partition the writer belongs to
+        source: Name of the source CSV, without extension
+        schema: Arrow schema of the rows that will be written
 
     Returns:
-        Path to the extracted CSV file
+        Tuple of (output file path, ParquetWriter)
     """
-    logger.info(f"Extracting {zip_path}")
+    # Create the output directory structure
+    output_dir = OUTPUT_DIR / f"year={year}" / f"month={month:02d}" / f"day={day:02d}" / f"hour={hour:02d}"
+    output_dir.mkdir(parents=True, exist_ok=True)
 
-    csv_path = None
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        for file in zip_ref.namelist():
-            if file.endswith('.csv'):
-                csv_path = TMP_DIR / file
-                zip_ref.extract(file, TMP_DIR)
-                logger.info(f"Extracted {file} to {csv_path}")
+    # Create output file path
+    output_file = output_dir / f"AIS_{year}_{month:02d}_{day:02d}_processed_hour{hour:02d}_part-{source}.parquet"
+
+    # Check if the file already exists
+    if output_file.exists():
+        logger.debug(f"File {output_file} already exists. It will be recreated.")
+        try:
+            # Delete the existing file
+            output_file.unlink()
+            logger.debug(f"Deleted existing file {output_file}")
+        except Exception as e:
+            logger.error(f"Error deleting existing file {output_file}: {e}")
+
+    # Versions before the part files wrote one file per hour. Its rows are written
+    # again as parts, so remove it to keep dataset reads from counting them twice
+    legacy_file = output_dir / f"AIS_{year}_{month:02d}_{day:02d}_processed_hour{hour:02d}.parquet"
+    if legacy_file.exists():
+        legacy_file.unlink()
+        logger.info(f"Deleted {legacy_file} written by an older version")
+
+    writer = pq.ParquetWriter(
+        output_file,
+        schema,
+        compression='zstd',
+        compression_level=3,
+        # Dictionary-encode every repetitive column. The 0.1-resolution floats and
+        # per-vessel dimensions have few distinct values, so this beats
+        # BYTE_STREAM_SPLIT for them; positions and timestamps are left plain.
+        use_dictionary=[
+            'MMSI', 'VesselName', 'IMO', 'CallSign', 'Cargo', 'TransceiverClass',
+            'SOG', 'COG', 'Heading', 'VesselType', 'Status', 'Length', 'Width', 'Draft'
+        ],
+        version='2.6',
+        data_page_version='2.0',
+        data_page_size=1048576,  # 1 MB pages
+        write_statistics=True,
+        # Page-level min/max, so a reader can skip the pages of other vessels
+        write_page_index=True,
+        # Declare the order written by write_row_group() for engines that use it
+        sorting_columns=[pq.SortingColumn(schema.get_field_index(name)) for name, _ in SORT_KEYS]
+    )
 
-    if not csv_path:
-        raise ValueError(f"No CSV file found in {zip_path}")
+    return output_file, writer
 
-    return csv_path
+def write_row_group(writer, table):
+    """
+    Sort a table by SORT_KEYS and write it as one row group
+
+    Args:
+        writer: ParquetWriter to append the row group to
+        table: Arrow table holding the rows
+    """
+    table = table.sort_by(SORT_KEYS)
+    writer.write_table(table, row_group_size=table.num_rows)
 
-def process_csv(csv_path):
+def process_csv(csv_file, csv_name):
     """
-    Process a CSV file line by line and write to Parquet files
+    Stream a CSV file block by block and write each row to its hour's Parquet file
+
+    Rows are buffered per hour and appended to that hour's open ParquetWriter as
+    one row group once ROW_GROUP_SIZE rows have collected, so memory stays bounded
+    by one CSV block plus the hour buffers. The row groups are sorted, encoded and
+    written on a thread pool while the next blocks are parsed. The writers are closed
+    at the end, or their files removed if the CSV could not be processed completely.
 
     Args:
-        csv_path: Path to the CSV file
+        csv_file: Path or file-like object to read the CSV from
+        csv_name: Name of the CSV, used in log messages
     """
-    logger.info(f"Processing {csv_path}")
+    logger.info(f"Processing {csv_name}")
+
+    # Name of the source used for the part files of this CSV
+    source = Path(csv_name).stem
 
     # Dictionary to keep track of rows per hour
     hour_counts = {}
 
-    # Dictionary to store dataframes by hour
-    hour_data = {}
-
-    # Define column types based on the data dictionary
-    dtypes = {
-        'MMSI': str,                 # Text (9)
-        'BaseDateTime': str,         # Read as string, will convert to datetime
-        'LAT': float,                # Double (8)
-        'LON': float,                # Double (8)
-        'SOG': float,                # Float (4)
-        'COG': float,                # Float (4)
-        'Heading': float,            # Float (4)
-        'VesselName': str,           # Text (32)
-        'IMO': str,                  # Text (7)
-        'CallSign': str,             # Text (8)
-        'VesselType': 'Int32',       # Integer short
-        'Status': 'Int32',           # Integer short
-        'Length': float,             # Float (4)
-        'Width': float,              # Float (4)
-        'Draft': float,              # Float (4)
-        'Cargo': str,                # Text (4)
-        'TransceiverClass': str      # Text (2)
-    }
-
-    # Read the entire CSV file
-    logger.info(f"Reading {csv_path}")
-    df = pd.read_csv(csv_path, dtype=dtypes)
-    total_rows = len(df)
-    logger.info(f"Read {total_rows:,} rows from {csv_path}")
-
-    # Convert BaseDateTime from string to datetime
-    df['BaseDateTime'] = pd.to_datetime(df['BaseDateTime'], format='%Y-%m-%dT%H:%M:%S')
-
-    # Add year, month, day, hour columns
-    df['year'] = df['BaseDateTime'].dt.year
-    df['month'] = df['BaseDateTime'].dt.month
-    df['day'] = df['BaseDateTime'].dt.day
-    df['hour'] = df['BaseDateTime'].dt.hour
-
-    # Group by year, month, day, hour
-    grouped = df.groupby(['year', 'month', 'day', 'hour'])
-
-    # Process each group
-    for (year, month, day, hour), group_df in grouped:
-        # Convert to integers to ensure proper directory naming
-        year, month, day, hour = int(year), int(month), int(day), int(hour)
-
-        # Create the output directory structure
-        output_dir = OUTPUT_DIR / f"year={year}" / f"month={month:02d}" / f"day={day:02d}" / f"hour={hour:02d}"
-        output_dir.mkdir(parents=True, exist_ok=True)
-
-        # Create output file path
-        output_file = output_dir / f"AIS_{year}_{month:02d}_{day:02d}_processed_hour{hour:02d}.parquet"
-
-        # Drop the partition columns before saving
-        data_to_save = group_df.drop(columns=['year', 'month', 'day', 'hour'])
-
-        # Check if the file already exists
-        if output_file.exists():
-            logger.info(f"File {output_file} already exists. It will be recreated.")
-            try:
-                # Delete the existing file
-                output_file.unlink()
-                logger.info(f"Deleted existing file {output_file}")
-            except Exception as e:
-                logger.error(f"Error deleting existing file {output_file}: {e}")
-
-        # Convert to pyarrow table
-        table = pa.Table.from_pandas(data_to_save)
-
-        # Write to parquet
-        pq.write_table(
-            table,
-            output_file,
-            compression='snappy',
-            use_dictionary=True,
-            version='2.6',
-            data_page_size=1048576,  # 1 MB pages
-            write_statistics=True
+    # Dictionary of open (output file, ParquetWriter) pairs by hour
+    writers = {}
+
+    # Batches of each hour not yet written, and how many rows they hold
+    hour_batches = defaultdict(list)
+    buffered_rows = defaultdict(int)
+
+    # Last write submitted for each hour
+    pending_writes = {}
+
+    total_rows = 0
+
+    def flush_hour(key, schema):
+        """Submit the buffered batches of an hour to be written to its file as one row group"""
+        if key not in writers:
+            writers[key] = open_hour_writer(*key, source, schema)
+
+        table = pa.Table.from_batches(hour_batches.pop(key), schema=schema)
+        del buffered_rows[key]
+
+        # A ParquetWriter is not thread-safe, so only one write per file runs at a time
+        if key in pending_writes:
+            pending_writes.pop(key).result()
+        pending_writes[key] = write_pool.submit(write_row_group, writers[key][1], table)
+
+    reader = pacsv.open_csv(
+        csv_file,
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(
+            column_types=CSV_COLUMN_TYPES,
+            # BaseDateTime is fixed-width ISO 8601 (YYYY-MM-DDTHH:MM:SS), which Arrow's
+            # built-in ISO parser handles faster than a strptime format string
+            timestamp_parsers=[pacsv.ISO8601],
+            strings_can_be_null=True
         )
+    )
 
-        # Track the number of rows written to this file
-        hour_counts[(year, month, day, hour)] = len(data_to_save)
-        logger.info(f"Saved {len(data_to_save):,} rows to {output_file}")
+    try:
+        # Encoding and compressing a row group releases the GIL, so writes run
+        # in the background while the reader parses the next block
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as write_pool:
+            for batch in reader:
+                total_rows += batch.num_rows
+
+                # Truncate each timestamp to the start of its hour to get a single partition key,
+                # then collect the row indices of every hour in one hash aggregation
+                hour_key = pc.floor_temporal(batch.column('BaseDateTime'), unit='hour')
+                hour_rows = pa.table({
+                    'hour_start': hour_key,
+                    'row': np.arange(batch.num_rows)
+                }).group_by('hour_start').aggregate([('row', 'list')])
+
+                # Route the rows of each hour in this block to that hour's buffer
+                for hour_start, rows in zip(hour_rows['hour_start'].to_pylist(), hour_rows['row_list'].combine_chunks()):
+                    if hour_start is None:
+                        continue
+                    key = (hour_start.year, hour_start.month, hour_start.day, hour_start.hour)
+
+                    data_to_save = batch.take(rows.values)
+                    hour_batches[key].append(data_to_save)
+                    buffered_rows[key] += data_to_save.num_rows
+
+                    # Track the number of rows written to this file
+                    hour_counts[key] = hour_counts.get(key, 0) + data_to_save.num_rows
+
+                    if buffered_rows[key] >= ROW_GROUP_SIZE:
+                        flush_hour(key, batch.schema)
+
+            # Write whatever is left of each hour
+            for key in list(hour_batches):
+                flush_hour(key, reader.schema)
+
+            # Raise any error from the writes before the files are closed
+            for future in pending_writes.values():
+                future.result()
+
+        for output_file, writer in writers.values():
+            writer.close()
+    except BaseException:
+        # The parts of this CSV hold only some of its rows, and would be read as
+        # complete hours once closed, so remove them rather than keep them
+        for output_file, writer in writers.values():
+            try:
+                writer.close()
+            except Exception:
+                pass
+            output_file.unlink(missing_ok=True)
+        logger.error(f"Removed the {len(writers)} partly written files of {csv_name}")
+        raise
 
-        # Upload to S3 if enabled
-        if ENABLE_S3_UPLOAD:
-            upload_to_s3(output_file)
+    logger.info(f"Read {total_rows:,} rows from {csv_name}")
 
-    # Log summary of rows written
-    logger.info("Summary of rows written to each output file:")
+    # Per-file details are only logged at DEBUG; the totals below are enough at INFO
+    output_files = []
     total_written = 0
-    for (year, month, day, hour), count in hour_counts.items():
-        total_written += count
-        logger.info(f"  {year}-{month:02d}-{day:02d} Hour {hour:02d}: {count:,} rows")
+    for key, (output_file, writer) in sorted(writers.items()):
+        logger.debug(f"Saved {hour_counts[key]:,} rows to {output_file}")
+        output_files.append(output_file)
+        total_written += hour_counts[key]
+
+    # Upload to S3 if enabled, several files at a time
+    if ENABLE_S3_UPLOAD:
+        # Create the shared client here rather than in the upload threads, so it
+        # is created once and an unreachable bucket fails the ZIP straight away
+        get_s3_transfer()
+
+        # Every file is attempted before the first failed upload is raised
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as upload_pool:
+            uploads = [upload_pool.submit(upload_to_s3, output_file) for output_file in output_files]
+        for upload in uploads:
+            upload.result()
 
+    # Log summary of rows written
     logger.info(f"Total rows processed: {total_rows:,}")
-    logger.info(f"Total rows written: {total_written:,}")
+    logger.info(f"Total rows written: {total_written:,} to {len(output_files)} hourly files")
 
     if total_written != total_rows:
         logger.warning(f"Row count mismatch! Read {total_rows:,} rows but wrote {total_written:,} rows")
 
+def get_s3_client():
+    """
+    Get the S3 client shared by all uploads, creating it on first use
+
+    The bucket is checked once when the client is created, so a wrong
+    endpoint or bad credentials show up before the first upload. The first
+    call must not be made from several threads at once, see process_csv().
+
+    Returns:
+        boto3 S3 client
+    """
+    global s3_client
+
+    if s3_client is None:
+        session = boto3.session.Session()
+        client = session.client(
+            's3',
+            region_name=S3_REGION,
+            endpoint_url=S3_ENDPOINT,
+            aws_access_key_id=S3_ACCESS_KEY,
+            aws_secret_access_key=S3_SECRET_KEY
+        )
+        client.head_bucket(Bucket=S3_BUCKET_NAME)
+        logger.info(f"Connected to s3://{S3_BUCKET_NAME}")
+        s3_client = client
+
+    return s3_client
+
+def get_s3_transfer():
+    """
+    Get the transfer manager shared by all uploads, creating it on first use
+
+    Returns:
+        S3Transfer using S3_TRANSFER_CONFIG
+    """
+    global s3_transfer
+
+    if s3_transfer is None:
+        s3_transfer = S3Transfer(get_s3_client(), S3_TRANSFER_CONFIG)
+
+    return s3_transfer
+
 def upload_to_s3(file_path):
     """
     Upload a file to S3
 
+    The local file is deleted once the upload succeeds. A failed upload is
+    raised, so the ZIP the file came from is not recorded as processed.
+
     Args:
         file_path: Path to the file to upload
     """
-    # Initialize S3 client
-    session = boto3.session.Session()
-    s3_client = session.client(
-        's3',
-        region_name=S3_REGION,
-        endpoint_url=S3_ENDPOINT,
-        aws_access_key_id=S3_ACCESS_KEY,
-        aws_secret_access_key=S3_SECRET_KEY
-    )
-
     # Upload the file
     s3_key = str(file_path.relative_to(OUTPUT_DIR))
     logger.info(f"Uploading file to s3://{S3_BUCKET_NAME}/{s3_key}")
 
     try:
-        s3_client.upload_file(
-            str(file_path),
-            S3_BUCKET_NAME,
-            s3_key
-        )
+        get_s3_transfer().upload_file(str(file_path), S3_BUCKET_NAME, s3_key)
         logger.info(f"Upload complete: s3://{S3_BUCKET_NAME}/{s3_key}")
 
-        # Verify the upload
-        try:
-            s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-            logger.info(f"Verified file exists in S3: s3://{S3_BUCKET_NAME}/{s3_key}")
-
-            # Delete local file after successful upload
-            file_path.unlink()
-            logger.info(f"Deleted local file {file_path}")
-        except Exception as e:
-            logger.error(f"Upload verification failed, keeping local file: {e}")
+        # upload_file only returns once S3 has stored the whole object
+        # (PutObject or CompleteMultipartUpload), so no extra HEAD is needed
+        file_path.unlink()
+        logger.info(f"Deleted local file {file_path}")
     except Exception as e:
-        logger.error(f"Error uploading to S3: {e}")
+        logger.error(f"Error uploading {file_path} to S3, keeping local file: {e}")
+        raise
 
-def process_zip_file(url):
+def download_zip(url):
     """
-    Download, extract, and process a single ZIP file
+    Download a single ZIP file to the temporary directory
 
     Args:
         url: URL to the ZIP file
+
+    Returns:
+        Path to the downloaded ZIP file
     """
-    try:
-        # Extract filename from URL
-        filename = url.split('/')[-1]
-        zip_path = TMP_DIR / filename
+    # Extract filename from URL
+    filename = url.split('/')[-1]
+    zip_path = TMP_DIR / filename
+
+    return download_file(url, zip_path)
+
+def process_zip_file(url, download):
+    """
+    Process a single ZIP file once its download has finished
 
-        # Download the file
-        download_file(url, zip_path)
+    Args:
+        url: URL to the ZIP file
+        download: Future returning the path of the downloaded ZIP file
+    """
+    try:
+        # Wait for the download to finish
+        zip_path = download.result()
 
-        # Extract the ZIP file
-        csv_path = extract_zip(zip_path)
+        # Process the CSV inside the ZIP file
+        process_zip(zip_path)
 
-        # Process the CSV file
-        process_csv(csv_path)
+        # Remember the file so later runs can skip it
+        record_processed(url, os.path.getsize(zip_path))
 
         # Clean up temporary files
         os.remove(zip_path)
         logger.info(f"Deleted {zip_path}")
 
-        os.remove(csv_path)
-        logger.info(f"Deleted {csv_path}")
-
     except Exception as e:
         logger.error(f"Error processing {url}: {e}")
 
+def load_manifest():
+    """
+    Load the URLs of the ZIP files recorded as processed in MANIFEST_FILE
+
+    Returns:
+        Set of URLs
+    """
+    if not MANIFEST_FILE.exists():
+        return set()
+
+    urls = set()
+    with open(MANIFEST_FILE) as f:
+        for line in f:
+            try:
+                urls.add(json.loads(line)['url'])
+            except (ValueError, KeyError):
+                # A line cut short by a crash, the ZIP will be processed again
+                logger.warning(f"Ignoring invalid line in {MANIFEST_FILE}: {line.strip()}")
+
+    return urls
+
+def record_processed(url, content_length):
+    """
+    Append a processed ZIP file to MANIFEST_FILE
+
+    Args:
+        url: URL to the ZIP file
+        content_length: Size of the downloaded ZIP file in bytes
+    """
+    with open(MANIFEST_FILE, 'a') as f:
+        f.write(json.dumps({
+            'url': url,
+            'content_length': content_length,
+            'completed_at': datetime.now().isoformat(timespec='seconds')
+        }) + '\n')
+
 def main():
     """Main function"""
     # Get the list of ZIP URLs
     urls = get_zip_urls()
 
-    # Process each ZIP file one at a time
-    for i, url in enumerate(urls):
-        logger.info(f"Processing file {i+1}/{len(urls)}: {url}")
-        process_zip_file(url)
+    # Don't download files again that an earlier run already converted
+    if SKIP_PROCESSED:
+        processed = load_manifest()
+        remaining = [url for url in urls if url not in processed]
+        if len(remaining) < len(urls):
+            logger.info(f"Skipping {len(urls) - len(remaining)} ZIP files that were already processed")
+        urls = remaining
+
+    # Download the next few ZIP files while the current one is processed, so the
+    # network and the CPU are both kept busy. Only DOWNLOAD_AHEAD downloads are
+    # queued at a time to bound the disk space used in TMP_DIR.
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_AHEAD) as download_pool:
+        downloads = deque(download_pool.submit(download_zip, url) for url in urls[:DOWNLOAD_AHEAD])
+
+        for i, url in enumerate(urls):
+            if i + DOWNLOAD_AHEAD < len(urls):
+                downloads.append(download_pool.submit(download_zip, urls[i + DOWNLOAD_AHEAD]))
+
+            logger.info(f"Processing file {i+1}/{len(urls)}: {url}")
+            process_zip_file(url, downloads.popleft())
 
     logger.info("Processing complete!")
 